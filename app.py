@@ -1,26 +1,47 @@
 import streamlit as st
-import pdfplumber
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
-import json
+import orjson
 import pandas as pd
 from typing import List, Dict, Optional, Tuple
-import tempfile
 from datetime import datetime
 import warnings
 from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.lib.enums import TA_LEFT
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from xml.sax.saxutils import escape
 from io import BytesIO
-import re
 import hashlib
+import re
+import zlib
+import asyncio
+import threading
+from concurrent.futures import as_completed
+from collections import Counter
+import numpy as np
+import pdf_pages
+
+# PyMuPDF is the fast path; pypdfium2 (also a native PDFium backend) is the fallback
+try:
+    import fitz
+except ImportError:
+    fitz = None
+    import pypdfium2 as pdfium
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
 
+# Must be the first Streamlit command of every run
+st.set_page_config(
+    page_title="MCQ Generator",
+    page_icon="📚",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
 # Load environment variables and configure API
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
@@ -30,8 +51,33 @@ if not GOOGLE_API_KEY:
     st.error("⚠️ Google API Key not found! Please add it to your .env file.")
     st.stop()
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODEL_NAME = 'gemini-2.5-flash'
+API_ENDPOINT = 'generativelanguage.googleapis.com'
+REQUEST_TIMEOUT = 30  # seconds; bounds the slowest of the parallel calls
+MAX_CONCURRENT_REQUESTS = 4  # Gemini calls in flight at once; a full burst trips per-minute quotas
+CONTENT_CHUNK_CHARS = 4000  # ~1k tokens of slide text per question prompt
+QUESTION_POOL_SIZE = 5  # extra questions generated per "Add New Question" refill
+MINHASH_PERMUTATIONS = 128
+MINHASH_PRIME = (1 << 31) - 1
+DUPLICATE_SIMILARITY = 0.85  # estimated Jaccard similarity (stem + options) above which a question counts as a repeat
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?])\s+')
+EXCLUDE_PROMPT_QUESTIONS = 10  # most recent used questions sent back to the model; keeps the prompt a fixed size
+
+# Structured output schema for a single MCQ (Gemini JSON mode)
+MCQ_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {
+            "type": "object",
+            "properties": {opt: {"type": "string"} for opt in "ABCD"},
+            "required": list("ABCD")
+        },
+        "correct_answer": {"type": "string"},
+        "explanation": {"type": "string"}
+    },
+    "required": ["question", "options", "correct_answer", "explanation"]
+}
 
 # Initialize session state with default values
 def initialize_session_state():
@@ -42,9 +88,16 @@ def initialize_session_state():
         'user_answers': {},
         'submitted': False,
         'selected_answers': {},
-        'pdf_content': None,
+        'pdf_text': None,
         'generation_count': 0,
-        'used_questions': set()
+        'used_questions': [],
+        'question_signatures': [],
+        'question_pool': [],
+        'question_pool_difficulty': None,
+        'submission_count': 0,
+        'pdf_report': None,
+        'pdf_report_submission': None,
+        'generation_warnings': []
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -52,122 +105,252 @@ def initialize_session_state():
 
 initialize_session_state()
 
-def extract_text_from_pdf(pdf_file) -> str:
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60, max_entries=16)
+def _extract_pdf_text(pdf_hash: str, _pdf_bytes: bytes) -> str:
+    """Parse PDF bytes into text; cached on the SHA-256 of the file"""
+    if fitz is None:
+        pdf = pdfium.PdfDocument(_pdf_bytes)
+        try:
+            if len(pdf) == 0:
+                raise ValueError("The PDF appears to be empty.")
+            return "\n".join(page.get_textpage().get_text_range() for page in pdf).strip()
+        finally:
+            pdf.close()
+    
+    with fitz.open(stream=_pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if page_count == 0:
+            raise ValueError("The PDF appears to be empty.")
+        
+        return pdf_pages.pages_text(doc, range(page_count)).strip()
+
+def extract_text_from_pdf(pdf_bytes: bytes) -> str:
     """Extract text from PDF with enhanced error handling"""
     try:
-        text = ""
-        with pdfplumber.open(pdf_file) as pdf:
-            total_pages = len(pdf.pages)
-            
-            if total_pages == 0:
-                st.error("The PDF appears to be empty.")
-                return ""
-            
-            progress_bar = st.progress(0)
-            for idx, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-                progress_bar.progress((idx + 1) / total_pages)
-            
-            progress_bar.empty()
-            
-        if len(text.strip()) < 100:
+        text = _extract_pdf_text(hashlib.sha256(pdf_bytes).hexdigest(), pdf_bytes)
+        
+        if len(text) < 100:
             st.warning("⚠️ Very little text extracted. The PDF might be image-based or scanned.")
         
-        return text.strip()
+        return text
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
         return ""
 
-def clean_json_response(response_text: str) -> str:
-    """Clean and extract JSON from LLM response"""
-    # Remove markdown code blocks
-    response_text = re.sub(r'```json\s*', '', response_text)
-    response_text = re.sub(r'```\s*', '', response_text)
+@st.cache_resource
+def get_model() -> genai.GenerativeModel:
+    """Configure the Gemini client once per process and return the shared model.
+
+    genai.configure drops the cached API clients, so it must not run on every rerun.
+    All calls go through the asyncio gRPC transport so concurrent requests are
+    multiplexed over one HTTP/2 channel.
+    """
+    genai.configure(
+        api_key=GOOGLE_API_KEY,
+        transport="grpc_asyncio",
+        client_options={"api_endpoint": API_ENDPOINT}
+    )
+    return genai.GenerativeModel(MODEL_NAME)
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start a long-lived event loop for async Gemini calls.
+
+    The async client keeps its gRPC channel bound to the loop it was first
+    used on, so every request has to run on the same loop.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_request_semaphore() -> asyncio.Semaphore:
+    """Shared limit on concurrent Gemini calls; only ever awaited on the shared event loop"""
+    return asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def submit_async(coro):
+    """Schedule a coroutine on the shared event loop; returns a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def split_content(content: str, max_chars: int = CONTENT_CHUNK_CHARS) -> List[str]:
+    """Split text into chunks of at most max_chars, breaking between lines or sentences where possible"""
+    chunks = []
+    current = []
+    current_len = 0
     
-    # Find JSON boundaries
-    start_idx = response_text.find('{')
-    end_idx = response_text.rfind('}') + 1
+    for line in content.splitlines():
+        pieces = [line] if len(line) <= max_chars else SENTENCE_BOUNDARY_RE.split(line)
+        for piece in pieces:
+            if current and current_len + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current = []
+                current_len = 0
+            # Sentences longer than a whole chunk are cut hard
+            while len(piece) > max_chars:
+                chunks.append(piece[:max_chars])
+                piece = piece[max_chars:]
+            current.append(piece)
+            current_len += len(piece) + 1
     
-    if start_idx == -1 or end_idx == 0:
-        raise ValueError("No valid JSON found in response")
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60, max_entries=16)
+def get_content_chunks(content_hash: str, _content: str) -> List[str]:
+    """Split a deck's text once; every later generation for it reuses the chunks"""
+    return split_content(_content)
+
+async def generate_single_mcq(content: str, difficulty: str, exclude_text: str, index: int, total: int) -> Optional[Dict]:
+    """Generate one MCQ; returns None if the question fails validation"""
+    prompt = f"""
+    Generate exactly 1 multiple choice question based on the following content.
+    Difficulty level: {difficulty}
     
-    return response_text[start_idx:end_idx]
-
-def generate_mcqs(content: str, num_questions: int, difficulty: str, exclude_questions: set = None) -> List[Dict]:
-    """Generate MCQs with improved error handling and validation"""
-    if not content or len(content.strip()) < 50:
-        st.error("Not enough content to generate questions.")
-        return []
+    This is question {index + 1} of {total} being generated independently from the same content.
+    To avoid overlapping with the others, focus on a concept from roughly part {index + 1} of {total} of the content.
+    {exclude_text}
+
+    Rules:
+    1. The question must have exactly one correct answer
+    2. All options must be relevant and plausible
+    3. The question should test understanding, not just memorization
+    4. Avoid ambiguous or trick questions
+    5. Make distractors (wrong answers) reasonable but clearly incorrect
+    6. correct_answer is the letter (A-D) of the correct option; the explanation says why it is correct and the others are wrong
+
+    Content:
+    {content}
+    """
     
-    try:
-        exclude_text = ""
-        if exclude_questions:
-            exclude_text = f"\n\nIMPORTANT: Do not generate questions similar to these already used questions:\n{list(exclude_questions)}"
-        
-        prompt = f"""
-        Generate exactly {num_questions} multiple choice questions based on the following content.
-        Difficulty level: {difficulty}
-        
-        {exclude_text}
-
-        Rules:
-        1. Each question must have exactly one correct answer
-        2. All options must be relevant and plausible
-        3. Questions should test understanding, not just memorization
-        4. Avoid ambiguous or trick questions
-        5. Make distractors (wrong answers) reasonable but clearly incorrect
-        6. Return ONLY valid JSON format, no markdown or additional text
-
-        Format (strict JSON):
-        {{
-            "questions": [
-                {{
-                    "question": "Clear, specific question text here?",
-                    "options": {{
-                        "A": "First option",
-                        "B": "Second option",
-                        "C": "Third option",
-                        "D": "Fourth option"
-                    }},
-                    "correct_answer": "A",
-                    "explanation": "Detailed explanation of why A is correct and others are wrong"
-                }}
-            ]
-        }}
-
-        Content:
-        {content[:4000]}
-        """
-        
-        response = model.generate_content(
+    async with get_request_semaphore():
+        response = await get_model().generate_content_async(
             prompt,
             generation_config=genai.types.GenerationConfig(
                 temperature=0.7,
                 top_p=0.8,
                 top_k=40,
-            )
+                response_mime_type="application/json",
+                response_schema=MCQ_SCHEMA,
+            ),
+            request_options={"timeout": REQUEST_TIMEOUT}
+        )
+    
+    question = orjson.loads(response.text)
+    if isinstance(question, dict) and validate_question(question):
+        return question
+    return None
+
+def _request_mcqs(content: str, content_hash: str, num_questions: int, difficulty: str, exclude_questions: List[str], chunk_offset: int) -> Tuple[List[Dict], Dict[str, int]]:
+    """Ask Gemini for MCQs in parallel.
+
+    Returns the valid questions and a count of failed calls by exception type.
+    Not memoized: every Start and every pool refill must come back with new questions.
+    """
+    exclude_text = ""
+    if exclude_questions:
+        exclude_text = f"\n\nIMPORTANT: Do not generate questions similar to these already used questions:\n{'; '.join(exclude_questions)}"
+    
+    # Spread the questions over the whole deck instead of sending only its opening
+    # chunk_offset rotates the starting chunk so follow-up batches draw on other slides
+    chunks = get_content_chunks(content_hash, content)
+    assignments = [(chunk_offset + (i * len(chunks)) // num_questions) % len(chunks) for i in range(num_questions)]
+    futures = []
+    for i, chunk_idx in enumerate(assignments):
+        part = assignments[:i].count(chunk_idx)
+        parts = assignments.count(chunk_idx)
+        futures.append(submit_async(generate_single_mcq(chunks[chunk_idx], difficulty, exclude_text, part, parts)))
+    
+    # Report each question as its call finishes rather than blocking on the slowest one
+    progress_bar = st.progress(0.0, text=f"Generating questions... 0/{num_questions}")
+    valid = 0
+    for done, future in enumerate(as_completed(futures), start=1):
+        if future.exception() is None and future.result() is not None:
+            valid += 1
+        progress_bar.progress(
+            done / num_questions,
+            text=f"Generating questions... {done}/{num_questions} ({valid} valid)"
+        )
+    progress_bar.empty()
+    
+    questions = [f.result() for f in futures if f.exception() is None and f.result() is not None]
+    
+    # Only fail when nothing came back; partial batches are reported by the caller
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if not questions and errors:
+        raise errors[0]
+    
+    return questions, dict(Counter(type(e).__name__ for e in errors))
+
+@st.cache_resource
+def get_minhash_params() -> Tuple[np.ndarray, np.ndarray]:
+    """Random (a, b) coefficients for the MinHash permutations h -> (a*h + b) mod p"""
+    rng = np.random.default_rng(47)
+    a = rng.integers(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    return a, b
+
+def question_minhash(question: Dict) -> np.ndarray:
+    """MinHash signature over the words and word pairs of a question's stem and options.
+
+    MCQ stems are short and formulaic ("What is the primary function of X?"), so
+    the options are what tell two questions on different topics apart.
+    """
+    text = " ".join([question['question'], *(question['options'][opt] for opt in sorted(question['options']))])
+    words = "".join(ch if ch.isalnum() else " " for ch in text.lower()).split()
+    shingles = set(words) | {f"{w1} {w2}" for w1, w2 in zip(words, words[1:])}
+    if not shingles:
+        return np.full(MINHASH_PERMUTATIONS, MINHASH_PRIME, dtype=np.uint64)
+    
+    a, b = get_minhash_params()
+    hashes = np.fromiter((zlib.crc32(sh.encode()) for sh in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(hashes, a) + b) % MINHASH_PRIME).min(axis=0)
+
+def register_unique_questions(questions: List[Dict]) -> List[Dict]:
+    """Drop questions that near-duplicate ones already used and record the rest"""
+    unique = []
+    for q in questions:
+        signature = question_minhash(q)
+        if any(np.mean(signature == seen) > DUPLICATE_SIMILARITY for seen in st.session_state.question_signatures):
+            continue
+        st.session_state.question_signatures.append(signature)
+        st.session_state.used_questions.append(q['question'][:50])
+        unique.append(q)
+    
+    skipped = len(questions) - len(unique)
+    if skipped:
+        st.session_state.generation_warnings.append(f"⚠️ Skipped {skipped} generated question(s) that repeated earlier ones.")
+    return unique
+
+def generate_mcqs(content: str, num_questions: int, difficulty: str, exclude_questions: list = None, chunk_offset: int = 0) -> List[Dict]:
+    """Generate MCQs with improved error handling and validation"""
+    if not content or len(content) < 50:
+        st.error("Not enough content to generate questions.")
+        return []
+    
+    try:
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        validated_questions, errors = _request_mcqs(
+            content,
+            content_hash,
+            num_questions,
+            difficulty,
+            exclude_questions or [],
+            chunk_offset
         )
-        
-        json_str = clean_json_response(response.text)
-        questions_data = json.loads(json_str)
-        
-        # Validate questions
-        if 'questions' not in questions_data:
-            raise ValueError("Invalid response format: missing 'questions' key")
-        
-        validated_questions = []
-        for q in questions_data['questions']:
-            if validate_question(q):
-                validated_questions.append(q)
         
         if len(validated_questions) < num_questions:
-            st.warning(f"⚠️ Only generated {len(validated_questions)} valid questions out of {num_questions} requested.")
+            message = f"⚠️ Only generated {len(validated_questions)} valid questions out of {num_questions} requested."
+            if errors:
+                message += " Failed requests: " + ", ".join(f"{count} × {name}" for name, count in errors.items()) + "."
+            rejected = num_questions - len(validated_questions) - sum(errors.values())
+            if rejected:
+                message += f" {rejected} rejected as malformed."
+            st.session_state.generation_warnings.append(message)
         
         return validated_questions
             
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         st.error(f"❌ Failed to parse questions. Please try again.")
         st.error(f"JSON Error: {str(e)}")
         return []
@@ -177,80 +360,58 @@ def generate_mcqs(content: str, num_questions: int, difficulty: str, exclude_que
 
 def validate_question(question: Dict) -> bool:
     """Validate question structure and content"""
-    required_keys = ['question', 'options', 'correct_answer', 'explanation']
-    
-    # Check all required keys exist
-    if not all(key in question for key in required_keys):
-        return False
-    
-    # Check options structure
-    if not isinstance(question['options'], dict):
-        return False
+    # Look each field up once; a missing key comes back as None and fails below
+    options = question.get('options')
+    correct_answer = question.get('correct_answer')
+    question_text = question.get('question')
+    explanation = question.get('explanation')
     
-    # Check if we have 4 options
-    if len(question['options']) != 4:
+    # Check options structure: a dict of exactly 4 options
+    if not isinstance(options, dict) or len(options) != 4:
         return False
     
     # Check if correct_answer is one of the options
-    if question['correct_answer'] not in question['options']:
+    if correct_answer not in options:
         return False
     
     # Check for minimum content length
-    if len(question['question']) < 10 or len(question['explanation']) < 20:
+    if not question_text or not explanation or len(question_text) < 10 or len(explanation) < 20:
         return False
     
     return True
 
-def draw_wrapped_text(c, text, x, y, max_width, font_size=12):
-    """Draw wrapped text on PDF canvas"""
-    c.setFont("Helvetica", font_size)
-    words = text.split()
-    lines = []
-    line = ""
-    
-    for word in words:
-        test_line = line + word + " "
-        if c.stringWidth(test_line) < max_width:
-            line = test_line
-        else:
-            if line:
-                lines.append(line.strip())
-            line = word + " "
-    
-    if line:
-        lines.append(line.strip())
-    
-    for line in lines:
-        if y < 50:  # Check if we need a new page
-            c.showPage()
-            y = 750
-            c.setFont("Helvetica", font_size)
-        c.drawString(x, y, line)
-        y -= (font_size + 3)
-    
-    return y
+@st.cache_resource
+def get_pdf_styles() -> Dict[str, ParagraphStyle]:
+    """Build the report's paragraph styles once per process"""
+    base = getSampleStyleSheet()
+    option = ParagraphStyle('Option', parent=base['Normal'], fontSize=10, leading=13, leftIndent=20)
+    return {
+        'normal': base['Normal'],
+        'score': base['Heading3'],
+        'title': ParagraphStyle('QuizTitle', parent=base['Title'], fontSize=20, alignment=TA_LEFT),
+        'heading': ParagraphStyle('QuestionHeading', parent=base['Normal'], fontName='Helvetica-Bold', fontSize=12, leading=15, spaceBefore=10),
+        'question': ParagraphStyle('QuestionText', parent=base['Normal'], fontSize=11, leading=14, leftIndent=10, spaceAfter=6),
+        'option': option,
+        'correct': ParagraphStyle('CorrectOption', parent=option, textColor=colors.Color(0, 0.6, 0)),
+        'incorrect': ParagraphStyle('IncorrectOption', parent=option, textColor=colors.Color(0.8, 0, 0)),
+        'label': ParagraphStyle('ExplanationLabel', parent=base['Normal'], fontName='Helvetica-Bold', fontSize=10, leftIndent=10, spaceBefore=6),
+        'explanation': ParagraphStyle('Explanation', parent=base['Normal'], fontName='Helvetica-Oblique', fontSize=9, leading=12, leftIndent=20, spaceAfter=12),
+    }
 
 def generate_pdf(questions, user_answers, correct, total, score_percentage):
     """Generate enhanced PDF with better formatting"""
     buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    margin = 50
-    max_width = width - 2 * margin
-    y = height - margin
-
-    # Header with better styling
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(margin, y, "MCQ Quiz Results")
-    y -= 25
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        leftMargin=50,
+        rightMargin=50,
+        topMargin=50,
+        bottomMargin=50,
+        pageCompression=1
+    )
     
-    c.setFont("Helvetica", 10)
-    c.drawString(margin, y, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    y -= 35
-
-    # Score summary box
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(margin, y, f"Final Score: {correct}/{total} ({score_percentage:.1f}%)")
+    styles = get_pdf_styles()
     
     if score_percentage >= 80:
         status = "Excellent! 🌟"
@@ -259,89 +420,66 @@ def generate_pdf(questions, user_answers, correct, total, score_percentage):
     else:
         status = "Keep practicing! 💪"
     
-    c.setFont("Helvetica", 12)
-    c.drawString(margin, y - 20, f"Status: {status}")
-    y -= 50
-
+    # Header and score summary
+    story = [
+        Paragraph("MCQ Quiz Results", styles['title']),
+        Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['normal']),
+        Spacer(1, 20),
+        Paragraph(f"<b>Final Score: {correct}/{total} ({score_percentage:.1f}%)</b>", styles['score']),
+        Paragraph(f"Status: {escape(status)}", styles['normal']),
+        Spacer(1, 20),
+    ]
+    
     # Questions
     for i, q in enumerate(questions):
         user_answer = user_answers.get(i, "Not answered")
         is_correct = user_answer == q['correct_answer']
-
-        if y < 150:  # Check if we need a new page
-            c.showPage()
-            y = height - margin
-
-        # Question header
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(margin, y, f"Question {i+1}:")
-        y -= 20
         
-        # Question text
-        c.setFont("Helvetica", 11)
-        y = draw_wrapped_text(c, q['question'], margin + 10, y, max_width - 10, 11)
-        y -= 10
-
-        # Options
-        c.setFont("Helvetica", 10)
+        story.append(Paragraph(f"Question {i+1}:", styles['heading']))
+        story.append(Paragraph(escape(q['question']), styles['question']))
+        
         for opt, text in sorted(q['options'].items()):
-            if y < 80:
-                c.showPage()
-                y = height - margin
-                c.setFont("Helvetica", 10)
-            
             # Color coding
             if opt == user_answer:
-                if is_correct:
-                    c.setFillColorRGB(0, 0.6, 0)  # Green
-                else:
-                    c.setFillColorRGB(0.8, 0, 0)  # Red
+                style = styles['correct'] if is_correct else styles['incorrect']
             elif opt == q['correct_answer'] and not is_correct:
-                c.setFillColorRGB(0, 0.6, 0)  # Green
+                style = styles['correct']
             else:
-                c.setFillColorRGB(0, 0, 0)  # Black
-
-            option_text = f"   {opt}. {text}"
-            if opt == user_answer:
-                option_text += " ← Your answer"
-            if opt == q['correct_answer']:
-                option_text += " ✓ Correct"
-                
-            y = draw_wrapped_text(c, option_text, margin + 20, y, max_width - 40, 10)
-            y -= 3
-
-        # Explanation
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont("Helvetica-Bold", 10)
-        y -= 10
-        if y < 60:
-            c.showPage()
-            y = height - margin
-        c.drawString(margin + 10, y, "Explanation:")
-        c.setFont("Helvetica-Oblique", 9)
-        y -= 15
-        y = draw_wrapped_text(c, q['explanation'], margin + 20, y, max_width - 40, 9)
-        y -= 25
-
-    c.save()
-    buffer.seek(0)
+                style = styles['option']
+            
+            option_text = "".join([
+                f"{opt}. {text}",
+                " ← Your answer" if opt == user_answer else "",
+                " ✓ Correct" if opt == q['correct_answer'] else ""
+            ])
+            
+            story.append(Paragraph(escape(option_text), style))
+        
+        story.append(Paragraph("Explanation:", styles['label']))
+        story.append(Paragraph(escape(q['explanation']), styles['explanation']))
+    
+    doc.build(story)
     return buffer.getvalue()
 
 def calculate_score():
     """Calculate quiz score with detailed statistics"""
-    correct = 0
-    total = len(st.session_state.questions)
-    unanswered = 0
+    questions = st.session_state.questions
+    user_answers = st.session_state.user_answers
+    total = len(questions)
     
-    for i, q in enumerate(st.session_state.questions):
-        if i in st.session_state.user_answers and st.session_state.user_answers[i]:
-            if st.session_state.user_answers[i] == q['correct_answer']:
-                correct += 1
-        else:
-            unanswered += 1
+    # Look each answer up once and reuse it for both counts
+    answers = [user_answers.get(i) for i in range(total)]
+    correct = sum(1 for answer, q in zip(answers, questions) if answer == q['correct_answer'])
+    unanswered = sum(1 for answer in answers if not answer)
     
     return correct, total, unanswered
 
+def show_generation_warnings():
+    """Show warnings queued during generation; they are queued because a successful generation reruns the script"""
+    for message in st.session_state.generation_warnings:
+        st.warning(message)
+    st.session_state.generation_warnings = []
+
 def reset_quiz():
     """Reset quiz state"""
     st.session_state.practice_mode = False
@@ -350,15 +488,16 @@ def reset_quiz():
     st.session_state.selected_answers = {}
     st.session_state.questions = []
     st.session_state.generation_count = 0
-    st.session_state.used_questions = set()
+    st.session_state.used_questions = []
+    st.session_state.question_signatures = []
+    st.session_state.question_pool = []
+    st.session_state.question_pool_difficulty = None
+    st.session_state.pdf_report = None
+    st.session_state.pdf_report_submission = None
 
 def main():
-    st.set_page_config(
-        page_title="MCQ Generator",
-        page_icon="📚",
-        layout="wide",
-        initial_sidebar_state="expanded"
-    )
+    # Configure the Gemini client once, before any request is made
+    get_model()
     
     # Sidebar with info
     with st.sidebar:
@@ -395,9 +534,7 @@ def main():
     )
     
     if uploaded_file:
-        # Save PDF content to session state
-        if st.session_state.pdf_content is None:
-            st.session_state.pdf_content = uploaded_file
+        pdf_bytes = uploaded_file.getvalue()
         
         # Configuration Options
         st.subheader("⚙️ Configuration")
@@ -427,35 +564,30 @@ def main():
             if st.button("🚀 Start Practice Mode", use_container_width=True, type="primary"):
                 with st.spinner("🔄 Processing slides and generating questions..."):
                     try:
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                            tmp_file.write(uploaded_file.getvalue())
-                            tmp_file_path = tmp_file.name
+                        text_content = extract_text_from_pdf(pdf_bytes)
+                        text_len = len(text_content)
 
-                        text_content = extract_text_from_pdf(tmp_file_path)
-                        os.unlink(tmp_file_path)
-
-                        if not text_content.strip():
+                        if not text_len:
                             st.error("❌ Could not extract text from the PDF. Please ensure it's not scanned or image-based.")
                             return
                         
-                        if len(text_content.strip()) < 100:
+                        if text_len < 100:
                             st.error("❌ Insufficient content extracted from PDF. Please try a different file.")
                             return
 
-                        questions = generate_mcqs(text_content, num_questions, difficulty)
+                        questions = register_unique_questions(
+                            generate_mcqs(text_content, num_questions, difficulty)
+                        )
                         if questions:
                             st.session_state.questions = questions
                             st.session_state.practice_mode = True
                             st.session_state.generation_count += 1
-                            st.session_state.pdf_content = text_content
-                            
-                            # Store question signatures to avoid duplicates
-                            for q in questions:
-                                st.session_state.used_questions.add(q['question'][:50])
+                            st.session_state.pdf_text = text_content
                             
                             st.success(f"✅ Generated {len(questions)} questions successfully!")
                             st.rerun()
                         else:
+                            show_generation_warnings()
                             st.error("❌ Failed to generate questions. Please try again.")
 
                     except Exception as e:
@@ -464,43 +596,52 @@ def main():
 
     # Practice Mode Section
     if st.session_state.practice_mode and st.session_state.questions:
+        show_generation_warnings()
+        
         if not st.session_state.submitted:
             st.subheader("📝 Practice Mode")
             st.info(f"Answer all {len(st.session_state.questions)} questions below and submit to see your score!")
             st.divider()
             
-            # Display Questions with better formatting
-            for i, q in enumerate(st.session_state.questions):
-                with st.container():
-                    st.markdown(f"### Question {i+1}")
-                    st.markdown(f"**{q['question']}**")
-                    
-                    options = {opt: text for opt, text in sorted(q['options'].items())}
-                    
-                    selected_answer = st.radio(
-                        "Select your answer:",
-                        list(options.keys()),
-                        key=f"q_{i}",
-                        format_func=lambda x: f"{x}. {options[x]}",
-                        index=None,
-                        help="Choose the best answer"
-                    )
-                    st.session_state.user_answers[i] = selected_answer
-                    st.divider()
+            # Collect every answer in one form so picking an option doesn't rerun the script
+            with st.form("quiz_form"):
+                for i, q in enumerate(st.session_state.questions):
+                    with st.container():
+                        st.markdown(f"### Question {i+1}")
+                        st.markdown(f"**{q['question']}**")
+                        
+                        # Labels are formatted once; dict.get serves as format_func without a per-question lambda
+                        labels = {opt: f"{opt}. {text}" for opt, text in sorted(q['options'].items())}
+                        
+                        st.radio(
+                            "Select your answer:",
+                            list(labels),
+                            key=f"q_{i}",
+                            format_func=labels.get,
+                            index=None,
+                            help="Choose the best answer"
+                        )
+                        st.divider()
+                
+                # Submit Button
+                col1, col2, col3 = st.columns([1, 1, 1])
+                with col2:
+                    answers_submitted = st.form_submit_button("✅ Submit Answers", use_container_width=True, type="primary")
             
-            # Submit Button
-            col1, col2, col3 = st.columns([1, 1, 1])
-            with col2:
-                if st.button("✅ Submit Answers", use_container_width=True, type="primary"):
-                    # Check if all questions are answered
-                    unanswered = [i+1 for i in range(len(st.session_state.questions)) 
-                                 if i not in st.session_state.user_answers or st.session_state.user_answers[i] is None]
-                    
-                    if unanswered:
-                        st.warning(f"⚠️ Please answer all questions before submitting. Unanswered: {', '.join(map(str, unanswered))}")
-                    else:
-                        st.session_state.submitted = True
-                        st.rerun()
+            if answers_submitted:
+                st.session_state.user_answers = {
+                    i: st.session_state.get(f"q_{i}") for i in range(len(st.session_state.questions))
+                }
+                
+                # Check if all questions are answered
+                unanswered = [i+1 for i, answer in st.session_state.user_answers.items() if answer is None]
+                
+                if unanswered:
+                    st.warning(f"⚠️ Please answer all questions before submitting. Unanswered: {', '.join(map(str, unanswered))}")
+                else:
+                    st.session_state.submitted = True
+                    st.session_state.submission_count += 1
+                    st.rerun()
 
         # Show Results
         if st.session_state.submitted:
@@ -564,35 +705,53 @@ def main():
                 if st.button("➕ Add New Question", use_container_width=True):
                     with st.spinner("🔄 Generating a new unique question..."):
                         try:
-                            if st.session_state.pdf_content:
-                                new_questions = generate_mcqs(
-                                    st.session_state.pdf_content,
-                                    1,
-                                    difficulty,
-                                    st.session_state.used_questions
-                                )
-                                if new_questions:
-                                    st.session_state.questions.append(new_questions[0])
-                                    st.session_state.used_questions.add(new_questions[0]['question'][:50])
+                            if st.session_state.pdf_text:
+                                # Serve from a pre-generated pool; refill it in one batch when empty
+                                if st.session_state.question_pool_difficulty != difficulty:
+                                    st.session_state.question_pool = []
+                                if not st.session_state.question_pool:
+                                    st.session_state.generation_count += 1
+                                    st.session_state.question_pool = generate_mcqs(
+                                        st.session_state.pdf_text,
+                                        QUESTION_POOL_SIZE,
+                                        difficulty,
+                                        st.session_state.used_questions[-EXCLUDE_PROMPT_QUESTIONS:],
+                                        chunk_offset=st.session_state.generation_count
+                                    )
+                                    st.session_state.question_pool_difficulty = difficulty
+                                
+                                # Skip pooled questions that turn out to repeat one already asked
+                                new_question = None
+                                while st.session_state.question_pool and new_question is None:
+                                    candidate = st.session_state.question_pool.pop(0)
+                                    if register_unique_questions([candidate]):
+                                        new_question = candidate
+                                
+                                if new_question is not None:
+                                    st.session_state.questions.append(new_question)
                                     st.session_state.submitted = False
                                     st.success("✅ New question added!")
                                     st.rerun()
                                 else:
+                                    show_generation_warnings()
                                     st.error("❌ Could not generate new question")
                         except Exception as e:
                             st.error(f"❌ Error: {str(e)}")
 
             with col2:
-                pdf_data = generate_pdf(
-                    st.session_state.questions,
-                    st.session_state.user_answers,
-                    correct,
-                    total,
-                    score_percentage
-                )
+                # Build the report once per submission; reruns while reviewing reuse it
+                if st.session_state.pdf_report_submission != st.session_state.submission_count:
+                    st.session_state.pdf_report = generate_pdf(
+                        st.session_state.questions,
+                        st.session_state.user_answers,
+                        correct,
+                        total,
+                        score_percentage
+                    )
+                    st.session_state.pdf_report_submission = st.session_state.submission_count
                 st.download_button(
                     label="📥 Download PDF Report",
-                    data=pdf_data,
+                    data=st.session_state.pdf_report,
                     file_name=f"quiz_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
                     mime="application/pdf",
                     use_container_width=True
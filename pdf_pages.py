@@ -0,0 +1,6 @@
+"""Page-level PDF text extraction with PyMuPDF"""
+
+def pages_text(doc, pages) -> str:
+    """Join the text of the given page numbers of an open PyMuPDF document"""
+    page_texts = [doc.load_page(i).get_text("text") or "" for i in pages]
+    return "\n".join(page_texts)